@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Eşleştirme hızı ve bellek ölçümü (sentetik galeri)
+
+Her galeri boyutu için veritabanı ayrı bir süreçte kurulur ve ölçüm de ayrı
+bir süreçte yapılır, böylece her boyutun tepe RSS değeri bağımsızdır.
+Düşük bellek profilinde ölçüm süreci pickle veritabanını hiç yüklemez;
+varsayılan profilin değeri ise pickle yükleme ve tam float32 galeriyi içerir.
+
+Düşük bellek profilinde tepe RSS'nin galeri boyutuyla artmadığı da kontrol
+edilir (en küçük ve en büyük boyut arası fark --flat-tolerance-mb altında).
+
+    python3 benchmark_matching.py --people 1000 4000 --samples 20 --low-memory --max-rss-mb 120
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import face_recognizer as fr
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Sürecin tepe RSS değeri (MB); ölçülemiyorsa None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux KB, macOS bayt döndürür
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def build(args, people):
+    """Sentetik veritabanını ve (düşük bellek profilinde) galeri deposunu yaz"""
+    rng = np.random.default_rng(args.seed)
+    db = {
+        f"kisi_{p:05d}": [rng.random(args.dim, dtype=np.float32) for _ in range(args.samples)]
+        for p in range(people)
+    }
+    fr.save_database(db)
+    if args.low_memory:
+        fr.write_gallery_store(db)
+
+
+def measure(args, people):
+    """Sorguları çalıştır, süre ve tepe RSS raporla"""
+    rng = np.random.default_rng(args.seed + 1)
+    queries = rng.random((args.queries, args.dim), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    if args.low_memory:
+        store = fr.load_gallery_store()
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for q in queries:
+            fr.rank_distances(store.names, fr.store_identity_distances(q, store, args.chunk_rows), args.top_k)
+        store.close()
+    else:
+        gallery = fr.build_gallery(fr.load_database())
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for q in queries:
+            fr.rank_identities(q, gallery, args.top_k)
+    elapsed = time.perf_counter() - start
+
+    rss = peak_rss_mb()
+    return {
+        "gallery_rows": people * args.samples,
+        "setup_s": round(setup, 4),
+        "ms_per_query": round(1000 * elapsed / max(1, args.queries), 3),
+        "peak_rss_mb": None if rss is None else round(rss, 1),
+    }
+
+
+def child_args(args, mode, workdir, people):
+    """Tek bir boyut için kurulum/ölçüm alt sürecinin komut satırı"""
+    cmd = [sys.executable, os.path.abspath(__file__), mode, "--workdir", workdir,
+           "--people", str(people), "--samples", str(args.samples), "--dim", str(args.dim),
+           "--queries", str(args.queries), "--top-k", str(args.top_k),
+           "--chunk-rows", str(args.chunk_rows), "--seed", str(args.seed)]
+    if args.low_memory:
+        cmd.append("--low-memory")
+    return cmd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gallery matching speed and peak memory.")
+    parser.add_argument("--people", type=int, nargs="+", default=[1000, 4000],
+                        help="Ölçülecek kişi sayıları (her biri ayrı süreçte)")
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=832)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--chunk-rows", type=int, default=fr.MATCH_CHUNK_ROWS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--low-memory", action="store_true")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="Tepe RSS bütçesi; aşılırsa çıkış kodu 1")
+    parser.add_argument("--flat-tolerance-mb", type=float, default=8.0,
+                        help="Düşük bellek profilinde boyutlar arası izin verilen tepe RSS artışı")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--build-only", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--measure-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.build_only or args.measure_only:
+        fr.FACE_DATABASE = os.path.join(args.workdir, "face_database.pkl")
+        fr.GALLERY_STORE = os.path.join(args.workdir, "face_gallery")
+        if args.build_only:
+            build(args, args.people[0])
+        else:
+            print(json.dumps(measure(args, args.people[0])))
+        return
+
+    runs = []
+    for people in args.people:
+        workdir = tempfile.mkdtemp(prefix="face_bench_", dir=args.workdir)
+        # Kurulum ayrı süreçte, böylece kurulum belleği ölçüme karışmaz
+        subprocess.run(child_args(args, "--build-only", workdir, people), check=True)
+        out = subprocess.run(child_args(args, "--measure-only", workdir, people),
+                             check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    result = {
+        "success": True,
+        "profile": "low_memory" if args.low_memory else "default",
+        "runs": runs,
+    }
+    peaks = [r["peak_rss_mb"] for r in runs]
+    if args.max_rss_mb is not None:
+        result["max_rss_mb"] = args.max_rss_mb
+        result["within_budget"] = all(p is not None and p <= args.max_rss_mb for p in peaks)
+        result["success"] = result["within_budget"]
+    if args.low_memory and len(runs) > 1 and None not in peaks:
+        result["rss_growth_mb"] = round(peaks[-1] - peaks[0], 1)
+        result["flat"] = result["rss_growth_mb"] <= args.flat_tolerance_mb
+        result["success"] = result["success"] and result["flat"]
+    print(json.dumps(result, ensure_ascii=False))
+    if not result["success"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ import json
 import numpy as np
 import pickle
 import os
+import queue
+import threading
+from face_recognizer import (GalleryStore, ensure_gallery_store, store_identity_distances,
+                             low_memory_enabled)
 
 FACE_DATABASE = "face_database.pkl"
 YUNET_MODEL = "face_detection_yunet_2023mar.onnx"
@@ -16,32 +20,181 @@ def load_database():
             return pickle.load(f)
     return {}
 
-def recognize_face_features(features, db):
-    """Özellikleri veritabanıyla karşılaştır"""
-    if not db or features is None:
+def database_signature():
+    """Veritabanı değişimini anlamak için ucuz imza (atomik rename inode'u da değiştirir)"""
+    try:
+        st = os.stat(FACE_DATABASE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+class LiveGallery:
+    """Bellekteki normalize örnek matrisi; yeni kayıtlar sadece eklenir"""
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        self.names = []
+        self.label_of = {}
+        self.counts = {}
+        self.matrix = None
+        self.labels = np.empty(0, dtype=np.int32)
+        self.size = 0
+    
+    def update(self, db):
+        """Veritabanındaki yeni örnekleri ekle; silme/azalma varsa baştan kur
+
+        Dönüş: (eklenen satır sayısı, galeri baştan kuruldu mu)
+        """
+        rebuilt = False
+        for name, count in self.counts.items():
+            stored = db.get(name)
+            n = len(stored) if isinstance(stored, list) else (0 if stored is None else 1)
+            if n < count:
+                self.reset()
+                rebuilt = True
+                break
+        
+        rows = []
+        labels = []
+        for name, stored_features in db.items():
+            samples = stored_features if isinstance(stored_features, list) else [stored_features]
+            new_samples = samples[self.counts.get(name, 0):]
+            if not new_samples:
+                continue
+            if name not in self.label_of:
+                self.label_of[name] = len(self.names)
+                self.names.append(name)
+            label = self.label_of[name]
+            self.counts[name] = len(samples)
+            for sf in new_samples:
+                rows.append(np.asarray(sf, dtype=np.float32).reshape(-1))
+                labels.append(label)
+        if rows:
+            self._append(np.vstack(rows), np.asarray(labels, dtype=np.int32))
+        return len(rows), rebuilt
+    
+    def _append(self, rows, labels):
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True) + 1e-8
+        needed = self.size + len(rows)
+        if self.matrix is None or needed > len(self.matrix):
+            # Kapasiteyi ikiye katla: ekleme başına kopya maliyeti sabit kalır
+            capacity = max(needed, 2 * (0 if self.matrix is None else len(self.matrix)), 64)
+            matrix = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+            label_buf = np.empty(capacity, dtype=np.int32)
+            if self.size:
+                matrix[:self.size] = self.matrix[:self.size]
+                label_buf[:self.size] = self.labels[:self.size]
+            self.matrix, self.labels = matrix, label_buf
+        self.matrix[self.size:needed] = rows
+        self.labels[self.size:needed] = labels
+        self.size = needed
+    
+    def nearest(self, features):
+        """En yakın örneğin kişisini ve uzaklığını döndür"""
+        if self.size == 0:
+            return None, float('inf')
+        distances = 1.0 - self.matrix[:self.size] @ features
+        i = int(np.argmin(distances))
+        return self.names[self.labels[i]], float(distances[i])
+
+def load_store():
+    """Güncel galeri deposu; veritabanı yoksa boş depo"""
+    store = ensure_gallery_store() if os.path.exists(FACE_DATABASE) else None
+    if store is None:
+        return GalleryStore([], 0, 0, None, 0, None, 0)
+    return store
+
+class StoreGallery:
+    """Düşük bellek profili: galeri diskteki float16 depodan parça parça okunur
+
+    Süreçte yalnızca kişi adları tutulur; bellek galeri boyutuyla büyümez.
+    Depo değişince açık dosyalar yenileriyle değiştirilir.
+    """
+    
+    def __init__(self, store):
+        self.store = store
+    
+    @property
+    def names(self):
+        return self.store.names
+    
+    @property
+    def size(self):
+        return self.store.rows
+    
+    def update(self, store):
+        """Yeni depoya geç; dönüş LiveGallery.update ile aynı: (eklenen, baştan kuruldu)"""
+        old = self.store
+        rebuilt = store.rows < old.rows or not set(old.names) <= set(store.names)
+        self.store = store
+        old.close()
+        return (0 if rebuilt else store.rows - old.rows), rebuilt
+    
+    def nearest(self, features):
+        """En yakın kişiyi ve uzaklığını döndür"""
+        if self.size == 0:
+            return None, float('inf')
+        identity_distances = store_identity_distances(features, self.store)
+        i = int(np.argmin(identity_distances))
+        return self.names[i], float(identity_distances[i])
+    
+    def close(self):
+        self.store.close()
+
+class DatabaseWatcher(threading.Thread):
+    """Veritabanını arka planda izler; değişince yükleyip kuyruğa bırakır
+
+    Yükleme (pickle ya da depo) kamera döngüsünü bekletmez; döngü kareler
+    arasında yalnızca yeni satırları galeriye ekler.
+    """
+    
+    def __init__(self, signature, loader=None, interval=1.0):
+        super().__init__(daemon=True)
+        self.signature = signature
+        self.loader = loader or load_database
+        self.interval = interval
+        self.updates = queue.Queue(maxsize=1)
+        self.stopped = threading.Event()
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            signature = database_signature()
+            if signature == self.signature:
+                continue
+            try:
+                loaded = self.loader()
+            except Exception:
+                # Yazma sırasında okunduysa bir sonraki turda tekrar dene
+                continue
+            self.signature = signature
+            # Kuyrukta eski bir sürüm varsa yenisiyle değiştir
+            try:
+                stale = self.updates.get_nowait()
+                if hasattr(stale, "close"):
+                    stale.close()
+            except queue.Empty:
+                pass
+            self.updates.put(loaded)
+    
+    def poll(self):
+        """Bekleyen en son veritabanını/depoyu döndür (yoksa None)"""
+        try:
+            return self.updates.get_nowait()
+        except queue.Empty:
+            return None
+    
+    def stop(self):
+        self.stopped.set()
+
+def recognize_face_features(features, gallery):
+    """Özellikleri galeriyle karşılaştır"""
+    if gallery.size == 0 or features is None:
         return None, 0.0
     
-    best_match = None
-    best_distance = float('inf')
-    
-    for name, stored_features in db.items():
-        if isinstance(stored_features, list):
-            for sf in stored_features:
-                sf = np.asarray(sf, dtype=np.float32).reshape(-1)
-                sf = sf / (np.linalg.norm(sf) + 1e-8)
-                distance = 1.0 - float(np.dot(features, sf))
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = name
-        else:
-            sf = np.asarray(stored_features, dtype=np.float32).reshape(-1)
-            sf = sf / (np.linalg.norm(sf) + 1e-8)
-            # Kosinüs tabanlı uzaklık (1 - dot)
-            distance = 1.0 - float(np.dot(features, sf))
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_match = name
+    # Kosinüs tabanlı uzaklık (1 - dot), tüm örnekler tek matris çarpımıyla
+    best_match, best_distance = gallery.nearest(features)
     
     # Debug: mesafe yazdır
     print(f"DEBUG: En yakın: {best_match}, Mesafe: {best_distance:.4f}", flush=True)
@@ -60,7 +213,7 @@ def extract_face_features(face_roi):
         # Yüzü normalize et (daha büyük boyut - daha fazla detay)
         face_roi = cv2.resize(face_roi, (128, 128))
         face_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-        face_gray = cv2.equalizeHist(face_gray)
+        cv2.equalizeHist(face_gray, dst=face_gray)
         
         # 1. Gelişmiş Histogram özelliği (256 bin)
         hist = cv2.calcHist([face_gray], [0], None, [256], [0, 256])
@@ -70,9 +223,10 @@ def extract_face_features(face_roi):
         hog = cv2.HOGDescriptor((128, 128), (16, 16), (8, 8), (8, 8), 9)
         hog_features = hog.compute(face_gray).flatten()
         
-        # 3. Laplacian kenar bilgisi
-        laplacian = cv2.Laplacian(face_gray, cv2.CV_64F)
-        laplacian_hist = cv2.calcHist([np.abs(laplacian).astype(np.uint8)], [0], None, [64], [0, 256])
+        # 3. Laplacian kenar bilgisi (int16: float64 ile aynı değerler, 1/4 bellek)
+        laplacian = cv2.Laplacian(face_gray, cv2.CV_16S)
+        np.abs(laplacian, out=laplacian)
+        laplacian_hist = cv2.calcHist([laplacian.astype(np.uint8)], [0], None, [64], [0, 256])
         laplacian_hist = cv2.normalize(laplacian_hist, laplacian_hist).flatten()
         
         # Tüm özellikleri birleştir
@@ -85,15 +239,137 @@ def extract_face_features(face_roi):
     except:
         return None
 
+def box_iou(a, b):
+    """İki (x, y, w, h) kutusunun kesişim/birleşim oranı"""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+class FaceTrack:
+    """Tek bir yüz izi: kaliteli karelerin ortalama özelliği ve son kimlik kararı
+
+    Galeri eşleştirmesi her karede değil, ortalama vektör belirgin
+    değiştiğinde ya da sabit aralıklarla yapılır.
+    """
+    
+    def __init__(self, box, window=10, match_every=10, match_change=0.02):
+        self.box = box
+        self.window = window
+        self.match_every = match_every
+        self.match_change = match_change
+        self.mean = None
+        self.count = 0
+        self.missed = 0
+        self.matched = None
+        self.frames_since_match = 0
+        self.name = None
+        self.confidence = 0.0
+    
+    def add(self, features):
+        """Yeni özelliği ortalamaya kat (pencere dolunca üstel ortalama)"""
+        self.count += 1
+        self.frames_since_match += 1
+        alpha = max(1.0 / self.count, 1.0 / self.window)
+        if self.mean is None:
+            self.mean = features.astype(np.float32, copy=True)
+        else:
+            self.mean *= 1.0 - alpha
+            self.mean += alpha * features
+    
+    def aggregate(self):
+        """Normalize ortalama özellik vektörü"""
+        return self.mean / (np.linalg.norm(self.mean) + 1e-8)
+    
+    def needs_match(self):
+        """Ortalama anlamlı değiştiyse veya süre dolduysa eşleştirme gerekir"""
+        if self.mean is None:
+            return False
+        if self.matched is None or self.frames_since_match >= self.match_every:
+            return True
+        return 1.0 - float(np.dot(self.aggregate(), self.matched)) > self.match_change
+    
+    def set_match(self, name, confidence):
+        self.matched = self.aggregate()
+        self.frames_since_match = 0
+        self.name = name
+        self.confidence = confidence
+
+def assess_face_quality(frame, face):
+    """Ucuz kalite kontrolü: boyut, YuNet skoru, bulanıklık, yaw tahmini
+
+    Eşikler ortam değişkenleriyle ayarlanabilir. Dönüş sözlüğündeki "ok"
+    False ise "reason" ilk başarısız kontrolü gösterir.
+    """
+    min_size = int(os.getenv("FACE_MIN_SIZE", "60"))
+    min_score = float(os.getenv("FACE_MIN_SCORE", "0.8"))
+    min_sharpness = float(os.getenv("FACE_MIN_SHARPNESS", "80"))
+    max_yaw = float(os.getenv("FACE_MAX_YAW", "30"))
+    
+    h, w = frame.shape[:2]
+    x, y, face_w, face_h = face[:4].astype(int)
+    score = float(face[-1])
+    quality = {"ok": False, "reason": None, "size": int(min(face_w, face_h)), "score": score}
+    
+    if quality["size"] < min_size:
+        quality["reason"] = "kucuk"
+        return quality
+    if score < min_score:
+        quality["reason"] = "skor"
+        return quality
+    
+    # Yaw: burun ucunun göz ortasına göre yatay kayması, göz arası mesafeye oranla
+    eye1, eye2, nose = face[4:6], face[6:8], face[8:10]
+    eye_dist = float(np.hypot(eye2[0] - eye1[0], eye2[1] - eye1[1])) + 1e-6
+    nose_offset = float(nose[0] - (eye1[0] + eye2[0]) / 2.0)
+    quality["yaw"] = float(np.degrees(np.arctan(2.0 * nose_offset / eye_dist)))
+    if abs(quality["yaw"]) > max_yaw:
+        quality["reason"] = "yan"
+        return quality
+    
+    # Bulanıklık: özelliklerin çıkarıldığı 128x128 gri yüzde Laplacian varyansı
+    # (daha küçük ölçek bulanıklığı gizler, skor yüz boyutuna bağlı kalır)
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(w, x + face_w), min(h, y + face_h)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        quality["reason"] = "kenar"
+        return quality
+    gray = cv2.cvtColor(cv2.resize(frame[y0:y1, x0:x1], (128, 128)), cv2.COLOR_BGR2GRAY)
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    quality["sharpness"] = float(std[0][0] ** 2)
+    if quality["sharpness"] < min_sharpness:
+        quality["reason"] = "bulanik"
+        return quality
+    
+    quality["ok"] = True
+    return quality
+
 def camera_face_recognition():
     try:
         # Veritabanını yükle
-        db = load_database()
-        if not db:
+        signature = database_signature()
+        if low_memory_enabled():
+            # Pickle hiç yüklenmez (depo eskiyse yalnızca bir kez yeniden yazılır)
+            gallery = StoreGallery(load_store())
+            loader = load_store
+        else:
+            db = load_database()
+            gallery = LiveGallery()
+            if db:
+                gallery.update(db)
+            # Ham veritabanı kopyası döngü boyunca tutulmaz
+            del db
+            loader = load_database
+        if gallery.size == 0:
             print(json.dumps({"success": False, "error": "Veritabanı boş"}), flush=True)
             return {"success": False, "error": "Veritabanı boş"}
         
-        print(json.dumps({"success": True, "message": f"{len(db)} kişi yüklendi"}), flush=True)
+        print(json.dumps({"success": True, "message": f"{len(gallery.names)} kişi yüklendi"}), flush=True)
+        
+        # Kamera açıkken eklenen kişiler için arka plan izleyici
+        watcher = DatabaseWatcher(signature, loader)
+        watcher.start()
         
         # YuNet modelini yükle
         detector = cv2.FaceDetectorYN.create(
@@ -110,15 +386,35 @@ def camera_face_recognition():
             return {"success": False, "error": "Kamera açılamadı"}
         
         print(json.dumps({"success": True, "message": "Gelişmiş kamera başladı - ESC ile çıkış"}), flush=True)
-        current_name = None
-        streak = 0
-        required_streak = 3
+        track = None
+        required_samples = 3
+        track_iou = 0.3
+        max_missed = 5
+        match_every = int(os.getenv("FACE_MATCH_EVERY", "10"))
+        match_change = float(os.getenv("FACE_MATCH_CHANGE", "0.02"))
         
         while True:
             ret, frame = cap.read()
             if not ret:
                 break
             
+            # Yeni kayıtlar varsa sadece eklenen satırları galeriye al
+            update = watcher.poll()
+            if update is not None:
+                added, rebuilt = gallery.update(update)
+                if rebuilt:
+                    # Kişi silinmiş olabilir: eski kimlik hemen bırakılır
+                    if track is not None:
+                        track.matched = None
+                        track.name = None
+                        track.confidence = 0.0
+                    print(json.dumps({"success": True, "message": f"Galeri yeniden kuruldu ({gallery.size} örnek, {len(gallery.names)} kişi)"}, ensure_ascii=False), flush=True)
+                elif added:
+                    # Yeni kişiler için mevcut iz yeniden eşleştirilsin
+                    if track is not None:
+                        track.matched = None
+                    print(json.dumps({"success": True, "message": f"{added} yeni örnek eklendi ({len(gallery.names)} kişi)"}, ensure_ascii=False), flush=True)
+            
             h, w = frame.shape[:2]
             detector.setInputSize((w, h))
             
@@ -131,52 +427,66 @@ def camera_face_recognition():
                 x, y, face_w, face_h = best_face[:4].astype(int)
                 confidence = best_face[-1]
                 
-                # Yüz bölgesini kes
-                face_roi = frame[y:y+face_h, x:x+face_w]
-                le_x, le_y, re_x, re_y = best_face[4:8]
-                le_rel = (float(le_x - x), float(le_y - y))
-                re_rel = (float(re_x - x), float(re_y - y))
-                angle = np.degrees(np.arctan2(re_rel[1] - le_rel[1], re_rel[0] - le_rel[0]))
-                M = cv2.getRotationMatrix2D((face_roi.shape[1] / 2.0, face_roi.shape[0] / 2.0), -angle, 1.0)
-                face_roi = cv2.warpAffine(face_roi, M, (face_roi.shape[1], face_roi.shape[0]), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+                # Kutu önceki izle örtüşmüyorsa yeni iz başlat
+                box = (int(x), int(y), int(face_w), int(face_h))
+                if track is None or box_iou(track.box, box) < track_iou:
+                    track = FaceTrack(box, match_every=match_every, match_change=match_change)
+                track.box = box
+                track.missed = 0
                 
-                # Özellikleri çıkar ve tanı
-                features = extract_face_features(face_roi)
-                if features is not None:
-                    name, recog_confidence = recognize_face_features(features, db)
-                    if name:
-                        if current_name == name:
-                            streak += 1
-                        else:
-                            current_name = name
-                            streak = 1
-                    else:
-                        if streak > 0:
-                            streak -= 1
-                            if streak == 0:
-                                current_name = None
-                    
-                    # KARE çerçeve
-                    size = max(face_w, face_h)
-                    center_x = x + face_w // 2
-                    center_y = y + face_h // 2
-                    x_square = max(0, min(w - size, center_x - size // 2))
-                    y_square = max(0, min(h - size, center_y - size // 2))
+                # Kalitesiz karelerde özellik çıkarma ve eşleştirme atlanır,
+                # iz ortalamasına da katılmaz
+                quality = assess_face_quality(frame, best_face)
+                if quality["ok"]:
+                    # Yüz bölgesini kes
+                    face_roi = frame[y:y+face_h, x:x+face_w]
+                    le_x, le_y, re_x, re_y = best_face[4:8]
+                    le_rel = (float(le_x - x), float(le_y - y))
+                    re_rel = (float(re_x - x), float(re_y - y))
+                    angle = np.degrees(np.arctan2(re_rel[1] - le_rel[1], re_rel[0] - le_rel[0]))
+                    M = cv2.getRotationMatrix2D((face_roi.shape[1] / 2.0, face_roi.shape[0] / 2.0), -angle, 1.0)
+                    face_roi = cv2.warpAffine(face_roi, M, (face_roi.shape[1], face_roi.shape[0]), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
                     
-                    if current_name and streak >= required_streak:
-                        # Tanındı - Yeşil çerçeve
-                        cv2.rectangle(frame, (x_square, y_square), (x_square+size, y_square+size), (0, 255, 0), 3)
-                        text = f"{current_name}: %{recog_confidence*100:.0f}"
-                        cv2.putText(frame, text, (x_square, y_square-10), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                    else:
-                        # Bilinmeyen - Kırmızı çerçeve
-                        cv2.rectangle(frame, (x_square, y_square), (x_square+size, y_square+size), (0, 0, 255), 3)
-                        cv2.putText(frame, "Bilinmeyen", (x_square, y_square-10), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+                    # Özellikleri çıkar, iz ortalamasına ekle; kimlik ortalamadan belirlenir
+                    features = extract_face_features(face_roi)
+                    if features is not None:
+                        track.add(features)
+                        if track.needs_match():
+                            name, recog_confidence = recognize_face_features(track.aggregate(), gallery)
+                            track.set_match(name, recog_confidence)
+                
+                # KARE çerçeve
+                size = max(face_w, face_h)
+                center_x = x + face_w // 2
+                center_y = y + face_h // 2
+                x_square = max(0, min(w - size, center_x - size // 2))
+                y_square = max(0, min(h - size, center_y - size // 2))
+                
+                if track.name and track.count >= required_samples:
+                    # Tanındı - Yeşil çerçeve
+                    cv2.rectangle(frame, (x_square, y_square), (x_square+size, y_square+size), (0, 255, 0), 3)
+                    text = f"{track.name}: %{track.confidence*100:.0f}"
+                    cv2.putText(frame, text, (x_square, y_square-10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                elif not quality["ok"]:
+                    # Kalitesiz kare - Sarı çerçeve
+                    cv2.rectangle(frame, (x_square, y_square), (x_square+size, y_square+size), (0, 255, 255), 3)
+                    cv2.putText(frame, f"Kalite: {quality['reason']}", (x_square, y_square-10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                else:
+                    # Bilinmeyen - Kırmızı çerçeve
+                    cv2.rectangle(frame, (x_square, y_square), (x_square+size, y_square+size), (0, 0, 255), 3)
+                    cv2.putText(frame, "Bilinmeyen", (x_square, y_square-10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            
+            elif track is not None:
+                # Yüz birkaç kare kaybolursa iz silinir
+                track.missed += 1
+                if track.missed > max_missed:
+                    track = None
             
             # Bilgi
-            cv2.putText(frame, f"Kayitli: {len(db)} kisi", (10, 30),
+            cv2.putText(frame, f"Kayitli: {len(gallery.names)} kisi", (10, 30),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             cv2.putText(frame, "ESC: Cikis", (10, frame.shape[0] - 10),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
@@ -186,6 +496,9 @@ def camera_face_recognition():
             if cv2.waitKey(1) & 0xFF == 27:
                 break
         
+        watcher.stop()
+        if isinstance(gallery, StoreGallery):
+            gallery.close()
         cap.release()
         cv2.destroyAllWindows()
         return {"success": True, "message": "Kamera kapatıldı"}
@@ -2,12 +2,15 @@
 import cv2
 import sys
 import json
+from frame_transport import (load_image, render_annotations, face_to_dict,
+                             parse_render_args, is_shared, frame_seq, write_result)
 
 YUNET_MODEL = "face_detection_yunet_2023mar.onnx"
 
-def detect_face(image_path):
+def detect_face(image_path, render=True, preview_max=None):
+    """Yüzleri tespit et; render=False ise görsel çizilmeden yalnızca kutular döner"""
     try:
-        img = cv2.imread(image_path)
+        img = load_image(image_path)
         if img is None:
             return {"success": False, "error": "Resim yuklenemedi"}
         
@@ -39,21 +42,39 @@ def detect_face(image_path):
         x_square = center_x - size // 2
         y_square = center_y - size // 2
         
-        # Yeşil kare çiz
-        cv2.rectangle(img, (x_square, y_square), (x_square + size, y_square + size), (0, 255, 0), 3)
-        cv2.putText(img, "Yuz Tespit Edildi", (x_square, y_square - 10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-        
-        output_path = image_path.replace('.', '_detected.')
-        cv2.imwrite(output_path, img)
-        
-        return {"success": True, "face_count": len(faces), "output_path": output_path}
+        result = {
+            "success": True,
+            "face_count": len(faces),
+            "faces": [face_to_dict(f) for f in faces],
+            "box": [int(x_square), int(y_square), int(size), int(size)]
+        }
+        if render:
+            # Yeşil kare çiz
+            result["output_path"] = render_annotations(
+                img,
+                [{"box": result["box"], "label": "Yuz Tespit Edildi", "color": (0, 255, 0)}],
+                image_path, '_detected', preview_max
+            )
+        return result
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    try:
+        args, render, preview_max = parse_render_args(sys.argv[1:])
+    except ValueError as e:
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=False))
+        sys.exit(1)
+    if not args:
         print(json.dumps({"success": False, "error": "Resim yolu yok"}))
         sys.exit(1)
-    result = detect_face(sys.argv[1])
+    if is_shared(args[0]):
+        # Sonuç, işlem başındaki kareye ait olmalı
+        try:
+            seq = frame_seq(args[0])
+            result = write_result(args[0], detect_face(args[0], render, preview_max), seq)
+        except (OSError, ValueError) as e:
+            result = {"success": False, "error": str(e)}
+    else:
+        result = detect_face(args[0], render, preview_max)
     print(json.dumps(result, ensure_ascii=False))
@@ -5,16 +5,30 @@ import json
 import numpy as np
 import pickle
 import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from frame_transport import (load_image, render_annotations, face_to_dict,
+                             parse_render_args, is_shared, frame_seq, write_result)
 
 # Basit face encoding için global değişkenler
 FACE_DATABASE = "face_database.pkl"
+# Düşük bellek profili için float16 bellek eşlemeli galeri (FACE_LOW_MEMORY=1)
+GALLERY_STORE = "face_gallery"
+MATCH_CHUNK_ROWS = 4096
 YUNET_MODEL = "face_detection_yunet_2023mar.onnx"
 
 def extract_face_features(image_path, augment=False):
     """Yüzden gelişmiş özellik çıkar (histogram + HOG)"""
     try:
         # Görüntüyü yükle
-        img = cv2.imread(image_path)
+        img = load_image(image_path)
         if img is None:
             return None, "Görsel yüklenemedi"
         
@@ -51,7 +65,7 @@ def extract_face_features(image_path, augment=False):
         # Yüzü normalize et (daha büyük boyut - daha fazla detay)
         face_roi = cv2.resize(face_roi, (128, 128))
         face_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-        face_gray = cv2.equalizeHist(face_gray)
+        cv2.equalizeHist(face_gray, dst=face_gray)
         
         # 1. Gelişmiş Histogram özelliği (256 bin - çok daha fazla detay)
         hist = cv2.calcHist([face_gray], [0], None, [256], [0, 256])
@@ -62,9 +76,10 @@ def extract_face_features(image_path, augment=False):
         hog_features = hog.compute(face_gray).flatten()
         
         # 3. LBP (Local Binary Pattern) benzeri basit doku özelliği
-        # Laplacian ile kenar bilgisi
-        laplacian = cv2.Laplacian(face_gray, cv2.CV_64F)
-        laplacian_hist = cv2.calcHist([np.abs(laplacian).astype(np.uint8)], [0], None, [64], [0, 256])
+        # Laplacian ile kenar bilgisi (int16: float64 ile aynı değerler, 1/4 bellek)
+        laplacian = cv2.Laplacian(face_gray, cv2.CV_16S)
+        np.abs(laplacian, out=laplacian)
+        laplacian_hist = cv2.calcHist([laplacian.astype(np.uint8)], [0], None, [64], [0, 256])
         laplacian_hist = cv2.normalize(laplacian_hist, laplacian_hist).flatten()
         
         combined_features = np.concatenate([hist, hog_features[:512], laplacian_hist]).astype(np.float32)
@@ -75,13 +90,14 @@ def extract_face_features(image_path, augment=False):
             face_roi_flip = cv2.flip(face_roi, 1)
             face_roi_flip = cv2.resize(face_roi_flip, (128, 128))
             face_gray_flip = cv2.cvtColor(face_roi_flip, cv2.COLOR_BGR2GRAY)
-            face_gray_flip = cv2.equalizeHist(face_gray_flip)
+            cv2.equalizeHist(face_gray_flip, dst=face_gray_flip)
             hist_f = cv2.calcHist([face_gray_flip], [0], None, [256], [0, 256])
             hist_f = cv2.normalize(hist_f, hist_f).flatten()
             hog_f = cv2.HOGDescriptor((128, 128), (16, 16), (8, 8), (8, 8), 9)
             hog_features_f = hog_f.compute(face_gray_flip).flatten()
-            laplacian_f = cv2.Laplacian(face_gray_flip, cv2.CV_64F)
-            laplacian_hist_f = cv2.calcHist([np.abs(laplacian_f).astype(np.uint8)], [0], None, [64], [0, 256])
+            laplacian_f = cv2.Laplacian(face_gray_flip, cv2.CV_16S)
+            np.abs(laplacian_f, out=laplacian_f)
+            laplacian_hist_f = cv2.calcHist([laplacian_f.astype(np.uint8)], [0], None, [64], [0, 256])
             laplacian_hist_f = cv2.normalize(laplacian_hist_f, laplacian_hist_f).flatten()
             combined_f = np.concatenate([hist_f, hog_features_f[:512], laplacian_hist_f]).astype(np.float32)
             features_f = combined_f / (np.linalg.norm(combined_f) + 1e-8)
@@ -99,29 +115,140 @@ def load_database():
             return pickle.load(f)
     return {}
 
+def database_file_mode():
+    """Mevcut veritabanının izinleri; yoksa open() ile açılacak olan (0666 & ~umask)"""
+    try:
+        return os.stat(FACE_DATABASE).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
 def save_database(db):
-    """Veritabanını kaydet"""
-    with open(FACE_DATABASE, 'wb') as f:
-        pickle.dump(db, f)
+    """Veritabanını atomik olarak kaydet (geçici dosya + rename)
+
+    Yazma yarıda kesilirse eski veritabanı bozulmadan kalır. Dosya izinleri
+    korunur (mkstemp 0600 açar); yeni dosya umask'a göre açılır.
+    """
+    directory = os.path.dirname(os.path.abspath(FACE_DATABASE))
+    fd, tmp_path = tempfile.mkstemp(prefix=".face_database.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(db, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, database_file_mode())
+        os.replace(tmp_path, FACE_DATABASE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@contextmanager
+def database_lock():
+    """Veritabanı için süreçler arası danışma kilidi (advisory lock)"""
+    with open(FACE_DATABASE + ".lock", 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def merge_samples(db, name, new_samples):
+    """Yeni örnekleri kişinin mevcut örneklerine ekle"""
+    existing = db.get(name)
+    if isinstance(existing, list):
+        existing.extend(new_samples)
+        db[name] = existing
+    elif existing is None:
+        db[name] = list(new_samples)
+    else:
+        db[name] = [existing] + list(new_samples)
+
+def pending_dir():
+    """Henüz veritabanına yazılmamış kayıtların bekletildiği klasör"""
+    return FACE_DATABASE + ".pending"
+
+def enqueue_samples(name, samples):
+    """Kaydı bekleme klasörüne atomik olarak bırak, dosya yolunu döndür"""
+    directory = pending_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{time.time_ns():020d}-{uuid.uuid4().hex}.pkl")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((name, samples), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+def commit_pending():
+    """Bekleyen tüm kayıtları tek bir yazmayla veritabanına işle (group commit)
+
+    Kilit alınmış olmalıdır. Dönüş: (veritabanı, işlenen kayıt sayısı)
+    """
+    directory = pending_dir()
+    entries = sorted(e for e in os.listdir(directory) if e.endswith(".pkl")) if os.path.isdir(directory) else []
+    db = load_database()
+    if not entries:
+        return db, 0
+    for entry in entries:
+        with open(os.path.join(directory, entry), 'rb') as f:
+            name, samples = pickle.load(f)
+        merge_samples(db, name, samples)
+    save_database(db)
+    # Veritabanı yazıldıktan hemen sonra silinir; arada çökme olursa kayıt
+    # en kötü ihtimalle iki kez eklenir, kaybolmaz.
+    for entry in entries:
+        os.remove(os.path.join(directory, entry))
+    if low_memory_enabled():
+        # Depo yazılamazsa eski kalır; load_gallery_store zaman damgasından
+        # bunu anlar ve depo bir sonraki okumada yeniden kurulur
+        try:
+            write_gallery_store(db)
+        except Exception:
+            pass
+    return db, len(entries)
 
 def add_person(image_path, name):
-    """Yeni kişi ekle"""
+    """Yeni kişi ekle
+
+    Örnekler önce bekleme klasörüne yazılır, sonra kilit altında bekleyen
+    tüm kayıtlar tek seferde işlenir. Aynı anda çalışan eklemeler birbirini
+    ezmez; kilidi alan süreç diğerlerinin kayıtlarını da yazar.
+    """
     try:
         features, error = extract_face_features(image_path, augment=True)
         if error:
             return {"success": False, "error": error}
         
-        db = load_database()
         new_samples = features if isinstance(features, list) else [features]
-        existing = db.get(name)
-        if isinstance(existing, list):
-            existing.extend(new_samples)
-            db[name] = existing
-        elif existing is None:
-            db[name] = new_samples
-        else:
-            db[name] = [existing] + new_samples
-        save_database(db)
+        spool_path = enqueue_samples(name, new_samples)
+        with database_lock():
+            if os.path.exists(spool_path):
+                try:
+                    db, _ = commit_pending()
+                except Exception:
+                    # Başarısız kayıt sonraki bir eklemeyle sessizce işlenmesin
+                    if os.path.exists(spool_path):
+                        os.remove(spool_path)
+                    raise
+            else:
+                # Başka bir süreç bu kaydı kendi yazmasıyla birlikte işledi
+                db = load_database()
         
         return {
             "success": True, 
@@ -132,11 +259,240 @@ def add_person(image_path, name):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def recognize_person(image_path):
-    """Fotoğraftaki kişiyi tanı ve yüzü işaretle"""
+def build_gallery(db):
+    """Veritabanını tek bir normalize matrise çevir (isimler, matris, başlangıç indeksleri)"""
+    names = []
+    rows = []
+    starts = []
+    for name, stored_features in db.items():
+        samples = stored_features if isinstance(stored_features, list) else [stored_features]
+        if not samples:
+            continue
+        names.append(name)
+        starts.append(len(rows))
+        rows.extend(np.asarray(sf, dtype=np.float32).reshape(-1) for sf in samples)
+    if not rows:
+        return names, np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.intp)
+    matrix = np.vstack(rows)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-8
+    return names, matrix, np.asarray(starts, dtype=np.intp)
+
+def low_memory_enabled():
+    """Düşük bellek profili açık mı? (FACE_LOW_MEMORY=1)"""
+    return os.getenv("FACE_LOW_MEMORY", "0") == "1"
+
+def gallery_store_paths():
+    """Galeri deposu dosyaları: float16 matris, kişi etiketleri, meta"""
+    return GALLERY_STORE + ".npy", GALLERY_STORE + "_labels.npy", GALLERY_STORE + "_meta.json"
+
+def _write_npy_rows(path, dtype, shape, rows):
+    """.npy dosyasını başlık + satır satır akışla yaz (tüm dizi bellekte tutulmaz)"""
+    with open(path, 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": shape,
+        })
+        for row in rows:
+            f.write(np.asarray(row, dtype=dtype).tobytes())
+
+def write_gallery_store(db):
+    """Veritabanını float16 galeri deposuna satır satır yaz (kilit alınmış olmalı)
+
+    Matris diske akışla yazılır; tüm galerinin float32 kopyası oluşmaz.
+    Meta dosyası en son yazılır, okuyucu satır sayısını onunla doğrular.
+    """
+    matrix_path, labels_path, meta_path = gallery_store_paths()
+    names = []
+    rows = 0
+    dim = 0
+    for name, stored_features in db.items():
+        samples = stored_features if isinstance(stored_features, list) else [stored_features]
+        if samples:
+            names.append(name)
+            rows += len(samples)
+            dim = dim or np.asarray(samples[0]).size
+    
+    def normalized_rows():
+        for name in names:
+            stored_features = db[name]
+            samples = stored_features if isinstance(stored_features, list) else [stored_features]
+            for sf in samples:
+                sf = np.asarray(sf, dtype=np.float32).reshape(-1)
+                yield sf / (np.linalg.norm(sf) + 1e-8)
+    
+    def label_rows():
+        for label, name in enumerate(names):
+            stored_features = db[name]
+            count = len(stored_features) if isinstance(stored_features, list) else 1
+            for _ in range(count):
+                yield label
+    
+    matrix_tmp = matrix_path + ".tmp"
+    labels_tmp = labels_path + ".tmp"
+    _write_npy_rows(matrix_tmp, np.float16, (rows, int(dim)), normalized_rows())
+    _write_npy_rows(labels_tmp, np.int32, (rows,), label_rows())
+    os.replace(matrix_tmp, matrix_path)
+    os.replace(labels_tmp, labels_path)
+    
+    meta_tmp = meta_path + ".tmp"
+    with open(meta_tmp, 'w', encoding='utf-8') as f:
+        json.dump({"names": names, "rows": rows, "dim": int(dim)}, f, ensure_ascii=False)
+    os.replace(meta_tmp, meta_path)
+
+def _open_npy(path):
+    """.npy dosyasını aç; (dosya, şekil, dtype, veri başlangıcı) döndür"""
+    f = open(path, 'rb')
+    try:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran_order:
+            raise ValueError("Fortran sıralı depo desteklenmiyor")
+        return f, shape, dtype, f.tell()
+    except BaseException:
+        f.close()
+        raise
+
+class GalleryStore:
+    """Açık galeri deposu; eşleştirme parça parça dosyadan okunarak yapılır
+
+    Satırlar bellek eşlenmez, her parça aynı tampona read ile okunur; bu
+    yüzden süreç belleği galeri boyutuyla büyümez (yalnızca kişi adları ve
+    kişi başına bir uzaklık tutulur). Dosyalar açık tutulduğu için depo
+    atomik olarak değiştirilse de bu nesne eski, tutarlı sürümü okur.
+    """
+    
+    def __init__(self, names, rows, dim, matrix_file, matrix_offset, labels_file, labels_offset):
+        self.names = names
+        self.rows = rows
+        self.dim = dim
+        self.matrix_file = matrix_file
+        self.matrix_offset = matrix_offset
+        self.labels_file = labels_file
+        self.labels_offset = labels_offset
+    
+    def chunks(self, chunk_rows=MATCH_CHUNK_ROWS):
+        """(başlangıç, float16 satırlar, etiketler) parçalarını sırayla üret
+
+        Dönen diziler her adımda üzerine yazılan ortak tamponlardır.
+        """
+        if self.rows == 0:
+            return
+        n_buf = max(1, min(chunk_rows, self.rows))
+        matrix_buf = np.empty((n_buf, self.dim), dtype=np.float16)
+        labels_buf = np.empty(n_buf, dtype=np.int32)
+        self.matrix_file.seek(self.matrix_offset)
+        self.labels_file.seek(self.labels_offset)
+        for start in range(0, self.rows, n_buf):
+            n = min(n_buf, self.rows - start)
+            if (self.matrix_file.readinto(matrix_buf[:n]) != matrix_buf[:n].nbytes
+                    or self.labels_file.readinto(labels_buf[:n]) != labels_buf[:n].nbytes):
+                raise ValueError("Galeri deposu eksik okundu")
+            yield start, matrix_buf[:n], labels_buf[:n]
+    
+    def close(self):
+        for f in (self.matrix_file, self.labels_file):
+            if f is not None:
+                f.close()
+
+def load_gallery_store():
+    """Galeri deposunu aç; yoksa, eskiyse veya tutarsızsa None
+
+    Veritabanı dosyası yoksa da None döner (temizlenmiş veritabanı).
+    """
+    matrix_path, labels_path, meta_path = gallery_store_paths()
+    matrix_file = labels_file = None
+    try:
+        if os.stat(meta_path).st_mtime_ns < os.stat(FACE_DATABASE).st_mtime_ns:
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        matrix_file, matrix_shape, matrix_dtype, matrix_offset = _open_npy(matrix_path)
+        labels_file, labels_shape, labels_dtype, labels_offset = _open_npy(labels_path)
+        if (matrix_shape != (meta["rows"], meta["dim"]) or labels_shape != (meta["rows"],)
+                or matrix_dtype != np.float16 or labels_dtype != np.int32):
+            raise ValueError("Galeri deposu meta ile uyuşmuyor")
+    except (OSError, ValueError):
+        for f in (matrix_file, labels_file):
+            if f is not None:
+                f.close()
+        return None
+    return GalleryStore(meta["names"], meta["rows"], meta["dim"],
+                        matrix_file, matrix_offset, labels_file, labels_offset)
+
+def ensure_gallery_store():
+    """Güncel galeri deposunu döndür, gerekirse veritabanından yeniden oluştur"""
+    store = load_gallery_store()
+    if store is None:
+        with database_lock():
+            store = load_gallery_store()
+            if store is None:
+                write_gallery_store(load_database())
+                store = load_gallery_store()
+    return store
+
+def store_identity_distances(features, store, chunk_rows=MATCH_CHUNK_ROWS):
+    """Depoyu parça parça tara; kişi başına en küçük uzaklık
+
+    Her parça float16'dan float32'ye çevrilip çarpılır; bellek kullanımı
+    parça boyutu + kişi sayısı kadardır, satır sayısıyla büyümez.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    identity_distances = np.full(len(store.names), np.inf, dtype=np.float32)
+    n_buf = max(1, min(chunk_rows, store.rows))
+    block = np.empty((n_buf, store.dim), dtype=np.float32)
+    scores = np.empty(n_buf, dtype=np.float32)
+    for _, rows, labels in store.chunks(chunk_rows):
+        n = len(rows)
+        block[:n] = rows
+        np.dot(block[:n], features, out=scores[:n])
+        np.subtract(1.0, scores[:n], out=scores[:n])
+        np.minimum.at(identity_distances, labels, scores[:n])
+    return identity_distances
+
+def rank_identities(features, gallery, top_k=1):
+    """Kişileri uzaklığa göre sırala; her kişi için en yakın örnek kullanılır"""
+    names, matrix, starts = gallery
+    distances = 1.0 - matrix @ features
+    # Örnekler kişi bazında ardışık: reduceat ile kişi başına minimum
+    identity_distances = np.minimum.reduceat(distances, starts)
+    return rank_distances(names, identity_distances, top_k)
+
+def rank_distances(names, identity_distances, top_k=1):
+    """Kişi başına uzaklıklardan sıralı adayları ve ilk iki fark değerini üret"""
+    n = len(names)
+    k = max(1, min(int(top_k or 1), n))
+    # Kısmi sıralama: fark için en az iki aday gerekir
+    kk = min(max(k, 2), n)
+    if kk < n:
+        idx = np.argpartition(identity_distances, kk - 1)[:kk]
+    else:
+        idx = np.arange(n)
+    idx = idx[np.argsort(identity_distances[idx], kind="stable")]
+    
+    candidates = [
+        {"name": names[i], "distance": float(identity_distances[i])}
+        for i in idx[:k]
+    ]
+    margin = None
+    if len(idx) >= 2:
+        margin = float(identity_distances[idx[1]] - identity_distances[idx[0]])
+    return {"candidates": candidates, "margin": margin}
+
+def recognize_person(image_path, top_k=None, render=True, preview_max=None):
+    """Fotoğraftaki kişiyi tanı ve yüzü işaretle
+
+    top_k verilirse sıralı adaylar da döner; render=False ise görsel
+    çizilmez/kaydedilmez, yalnızca kutu ve kimlik bilgisi döner.
+    """
+    if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+        return {"success": False, "error": f"top_k pozitif bir tam sayı olmalı: {top_k}"}
     try:
         # Görüntüyü yükle
-        img = cv2.imread(image_path)
+        img = load_image(image_path)
         if img is None:
             return {"success": False, "error": "Görsel yüklenemedi"}
         
@@ -165,7 +521,7 @@ def recognize_person(image_path):
         face_roi = img[y:y+face_h, x:x+face_w]
         face_roi_resized = cv2.resize(face_roi, (128, 128))
         face_gray = cv2.cvtColor(face_roi_resized, cv2.COLOR_BGR2GRAY)
-        face_gray = cv2.equalizeHist(face_gray)
+        cv2.equalizeHist(face_gray, dst=face_gray)
         
         # 1. Gelişmiş Histogram özelliği (256 bin)
         hist = cv2.calcHist([face_gray], [0], None, [256], [0, 256])
@@ -176,8 +532,9 @@ def recognize_person(image_path):
         hog_features = hog.compute(face_gray).flatten()
         
         # 3. Laplacian kenar bilgisi
-        laplacian = cv2.Laplacian(face_gray, cv2.CV_64F)
-        laplacian_hist = cv2.calcHist([np.abs(laplacian).astype(np.uint8)], [0], None, [64], [0, 256])
+        laplacian = cv2.Laplacian(face_gray, cv2.CV_16S)
+        np.abs(laplacian, out=laplacian)
+        laplacian_hist = cv2.calcHist([laplacian.astype(np.uint8)], [0], None, [64], [0, 256])
         laplacian_hist = cv2.normalize(laplacian_hist, laplacian_hist).flatten()
         
         # Tüm özellikleri birleştir
@@ -185,30 +542,26 @@ def recognize_person(image_path):
         # L2 normalize
         features = features / (np.linalg.norm(features) + 1e-8)
         
-        db = load_database()
-        if not db:
-            return {"success": False, "error": "Veritabanı boş"}
-        
-        # Histogram karşılaştırma (chi-square)
-        best_match = None
-        best_distance = float('inf')
-        
-        for name, stored_features in db.items():
-            if isinstance(stored_features, list):
-                for sf in stored_features:
-                    sf = np.asarray(sf, dtype=np.float32).reshape(-1)
-                    sf = sf / (np.linalg.norm(sf) + 1e-8)
-                    distance = 1.0 - float(np.dot(features, sf))
-                    if distance < best_distance:
-                        best_distance = distance
-                        best_match = name
-            else:
-                sf = np.asarray(stored_features, dtype=np.float32).reshape(-1)
-                sf = sf / (np.linalg.norm(sf) + 1e-8)
-                distance = 1.0 - float(np.dot(features, sf))
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = name
+        if low_memory_enabled():
+            # float16 depo üzerinde parça parça eşleştirme (sabit bellek)
+            if not os.path.exists(FACE_DATABASE):
+                return {"success": False, "error": "Veritabanı boş"}
+            store = ensure_gallery_store()
+            if store is None or not store.names:
+                return {"success": False, "error": "Veritabanı boş"}
+            try:
+                ranking = rank_distances(store.names, store_identity_distances(features, store), top_k)
+            finally:
+                store.close()
+        else:
+            gallery = build_gallery(load_database())
+            if not gallery[0]:
+                return {"success": False, "error": "Veritabanı boş"}
+            
+            # Vektörize kosinüs uzaklığı, kişi bazında en yakın örnek
+            ranking = rank_identities(features, gallery, top_k)
+        best_match = ranking["candidates"][0]["name"]
+        best_distance = ranking["candidates"][0]["distance"]
         
         # Kare çerçeve hesapla (camera_detector ile aynı)
         size = max(face_w, face_h)
@@ -220,41 +573,43 @@ def recognize_person(image_path):
         # Eşik değeri (yeni özellik vektörü için optimize edilmiş)
         # Daha düşük = daha seçici tanıma
         THRESHOLD = float(os.getenv("FACE_THRESHOLD", "0.35"))
+        extra = {}
+        if top_k is not None:
+            for c in ranking["candidates"]:
+                c["confidence"] = max(0.0, 1.0 - c["distance"] / THRESHOLD)
+                c["accepted"] = c["distance"] < THRESHOLD
+            extra = {"candidates": ranking["candidates"], "margin": ranking["margin"]}
+        
+        box = [int(x_square), int(y_square), int(size), int(size)]
         if best_distance < THRESHOLD:
             confidence = (1.0 - (best_distance / THRESHOLD)) * 100
-            # Yeşil kare çiz
-            cv2.rectangle(img, (x_square, y_square), (x_square + size, y_square + size), (0, 255, 0), 3)
-            cv2.putText(img, f"{best_match}: %{confidence:.1f}", (x_square, y_square - 10),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-            
-            # Çıktı kaydet
-            output_path = image_path.replace('.', '_recognized.')
-            cv2.imwrite(output_path, img)
-            
-            return {
+            result = {
                 "success": True,
                 "name": best_match,
                 "confidence": confidence / 100,
                 "message": f"Tanındı: {best_match}",
-                "output_path": output_path
+                "face": face_to_dict(best_face),
+                "box": box,
+                **extra
             }
+            # Yeşil kare
+            annotation = {"box": box, "label": f"{best_match}: %{confidence:.1f}", "color": (0, 255, 0)}
         else:
-            # Kırmızı kare çiz
-            cv2.rectangle(img, (x_square, y_square), (x_square + size, y_square + size), (0, 0, 255), 3)
-            cv2.putText(img, "Bilinmeyen", (x_square, y_square - 10),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-            
-            # Çıktı kaydet
-            output_path = image_path.replace('.', '_recognized.')
-            cv2.imwrite(output_path, img)
-            
-            return {
+            result = {
                 "success": False,
                 "message": "Bilinmeyen kişi",
                 "closest": best_match,
                 "distance": float(best_distance),
-                "output_path": output_path
+                "face": face_to_dict(best_face),
+                "box": box,
+                **extra
             }
+            # Kırmızı kare
+            annotation = {"box": box, "label": "Bilinmeyen", "color": (0, 0, 255)}
+        
+        if render:
+            result["output_path"] = render_annotations(img, [annotation], image_path, '_recognized', preview_max)
+        return result
         
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -274,32 +629,61 @@ def list_people():
 def clear_database():
     """Veritabanını temizle"""
     try:
-        if os.path.exists(FACE_DATABASE):
-            os.remove(FACE_DATABASE)
+        with database_lock():
+            for path in (FACE_DATABASE,) + gallery_store_paths():
+                if os.path.exists(path):
+                    os.remove(path)
+            # Bekleyen kayıtlar da silinir, yoksa sonraki ekleme onları geri getirir
+            directory = pending_dir()
+            if os.path.isdir(directory):
+                for entry in os.listdir(directory):
+                    os.remove(os.path.join(directory, entry))
         return {"success": True, "message": "Veritabanı temizlendi"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    try:
+        argv, render, preview_max = parse_render_args(sys.argv)
+    except ValueError as e:
+        print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=False))
+        sys.exit(1)
+    if len(argv) < 2:
         print(json.dumps({"success": False, "error": "Komut belirtilmedi"}))
         sys.exit(1)
     
-    command = sys.argv[1]
+    command = argv[1]
     
     if command == "add":
-        if len(sys.argv) < 4:
+        if len(argv) < 4:
             print(json.dumps({"success": False, "error": "Kullanım: add <image_path> <name>"}))
         else:
-            result = add_person(sys.argv[2], sys.argv[3])
+            result = add_person(argv[2], argv[3])
             print(json.dumps(result, ensure_ascii=False))
     
     elif command == "recognize":
-        if len(sys.argv) < 3:
-            print(json.dumps({"success": False, "error": "Kullanım: recognize <image_path>"}))
+        if len(argv) < 3:
+            print(json.dumps({"success": False, "error": "Kullanım: recognize <image_path> [top_k] [--results-only] [--preview=N]"}))
         else:
-            result = recognize_person(sys.argv[2])
-            print(json.dumps(result, ensure_ascii=False))
+            top_k = None
+            if len(argv) > 3:
+                try:
+                    top_k = int(argv[3])
+                except ValueError:
+                    top_k = 0
+            if top_k is not None and top_k < 1:
+                print(json.dumps({"success": False, "error": f"top_k pozitif bir tam sayı olmalı: {argv[3]}"}, ensure_ascii=False))
+            elif is_shared(argv[2]):
+                # Sonuç, işlem başındaki kareye ait olmalı
+                try:
+                    seq = frame_seq(argv[2])
+                    result = write_result(argv[2], recognize_person(argv[2], top_k, render, preview_max), seq)
+                except (OSError, ValueError) as e:
+                    result = {"success": False, "error": str(e)}
+                print(json.dumps(result, ensure_ascii=False))
+            else:
+                result = recognize_person(argv[2], top_k, render, preview_max)
+                print(json.dumps(result, ensure_ascii=False))
     
     elif command == "list":
         result = list_people()
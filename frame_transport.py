@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""Paylaşılan bellek üzerinden kare aktarımı (UI <-> Python, diske yazmadan)
+
+Arabellek, bellek eşlemeli bir dosyadır. Kısa isimler ("shm:isim") yalnızca
+Linux'ta /dev/shm (tmpfs) altına çözülür; /dev/shm bulunmayan sistemlerde
+(Windows, macOS) "shm:" ile tam dosya yolu verilmelidir. C# tarafı
+MemoryMappedFile.CreateFromFile ile aynı dosyayı açabilir (arayüz henüz
+bu protokolü kullanmıyor; yalnızca motor tarafı hazır). Düzen:
+
+    [0, 64)                      başlık (HEADER_FORMAT, little-endian)
+    [64, 64 + h*w*c)             ham BGR kare (uint8, satır satır)
+    [64 + h*w*c, ... + capacity) sonuç JSON'u (UTF-8)
+
+Başlık alanları: magic, version, flags, width, height, channels,
+seq (her yeni karede artar), result_len, result_capacity, result_seq.
+
+Üretici kareyi yazarken flags içinde FLAG_WRITING bitini tutar ve yazma
+bitince seq'i artırıp biti temizler. Okuyucu bu bit açıkken ya da hiç kare
+yazılmamışken (seq == 0) kareyi reddeder; işlem bittiğinde seq değişmişse
+kare işlem sırasında ezilmiş demektir ve sonuç yerine hata yazılır.
+result_seq, sonucun hangi kareye ait olduğunu gösterir; üretici kendi
+yazdığı seq ile karşılaştırarak eski sonuçları ayırt eder.
+
+Komut satırı araçlarına görsel yolu yerine "shm:<yol>" verilebilir;
+normal dosya yolları eskisi gibi çalışır.
+"""
+import json
+import mmap
+import os
+import struct
+
+import cv2
+import numpy as np
+
+SHM_PREFIX = "shm:"
+SHM_DIR = "/dev/shm"
+MAGIC = b"YFRM"
+VERSION = 2
+HEADER_FORMAT = "<4sHHIIIIIII"
+HEADER_SIZE = 64
+DEFAULT_RESULT_CAPACITY = 64 * 1024
+FLAG_WRITING = 0x1
+
+
+def is_shared(source):
+    """Kaynak paylaşılan bellek arabelleği mi?"""
+    return isinstance(source, str) and source.startswith(SHM_PREFIX)
+
+
+def shm_path(source):
+    """'shm:isim' veya 'shm:/tam/yol' ifadesini dosya yoluna çevir"""
+    name = source[len(SHM_PREFIX):] if is_shared(source) else source
+    if os.path.isabs(name):
+        return name
+    if not os.path.isdir(SHM_DIR):
+        raise ValueError(f"{SHM_DIR} bu sistemde yok; 'shm:' ile tam dosya yolu verin")
+    return os.path.join(SHM_DIR, name)
+
+
+def _read_header(mm):
+    fields = struct.unpack_from(HEADER_FORMAT, mm, 0)
+    if fields[0] != MAGIC:
+        raise ValueError("Geçersiz paylaşılan kare başlığı")
+    if fields[1] != VERSION:
+        raise ValueError(f"Desteklenmeyen kare protokolü sürümü: {fields[1]}")
+    keys = ("magic", "version", "flags", "width", "height", "channels",
+            "seq", "result_len", "result_capacity", "result_seq")
+    return dict(zip(keys, fields))
+
+
+def _write_header(mm, header):
+    struct.pack_into(HEADER_FORMAT, mm, 0, MAGIC, VERSION, header["flags"],
+                     header["width"], header["height"], header["channels"],
+                     header["seq"], header["result_len"], header["result_capacity"],
+                     header["result_seq"])
+
+
+def _map(path):
+    fd = os.open(path, os.O_RDWR)
+    try:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE)
+    finally:
+        os.close(fd)
+
+
+def create_shared_frame(source, width, height, channels=3,
+                        result_capacity=DEFAULT_RESULT_CAPACITY):
+    """Verilen boyutlar için boş bir paylaşılan kare arabelleği oluştur"""
+    path = shm_path(source)
+    frame_size = width * height * channels
+    with open(path, "wb") as f:
+        f.truncate(HEADER_SIZE + frame_size + result_capacity)
+    mm = _map(path)
+    try:
+        _write_header(mm, {"flags": 0, "width": width, "height": height,
+                           "channels": channels, "seq": 0, "result_len": 0,
+                           "result_capacity": result_capacity, "result_seq": 0})
+    finally:
+        mm.close()
+    return SHM_PREFIX + path
+
+
+def _check_frame(header):
+    if header["flags"] & FLAG_WRITING:
+        raise ValueError("Kare henüz yazılıyor")
+    if header["seq"] == 0:
+        raise ValueError("Arabellekte kare yok")
+
+
+def frame_seq(source):
+    """Arabellekteki tamamlanmış karenin sıra numarası"""
+    mm = _map(shm_path(source))
+    try:
+        header = _read_header(mm)
+        _check_frame(header)
+        return header["seq"]
+    finally:
+        mm.close()
+
+
+def open_shared_frame(source):
+    """Paylaşılan kareyi kopyasız, yazılabilir bir numpy görünümü olarak aç
+
+    Görünüm eşlemeyi canlı tutar; üzerine çizilen her şey doğrudan
+    arabelleğe yazılır. Yazılmakta olan ya da hiç yazılmamış kare reddedilir.
+    """
+    mm = _map(shm_path(source))
+    header = _read_header(mm)
+    _check_frame(header)
+    shape = (header["height"], header["width"], header["channels"])
+    count = shape[0] * shape[1] * shape[2]
+    return np.frombuffer(mm, dtype=np.uint8, count=count, offset=HEADER_SIZE).reshape(shape)
+
+
+def write_frame(source, img):
+    """Kareyi arabelleğe kopyala ve sıra numarasını artır
+
+    Kopya süresince FLAG_WRITING açık kalır; okuyucular yarım kareyi görmez.
+    """
+    mm = _map(shm_path(source))
+    try:
+        header = _read_header(mm)
+        h, w = img.shape[:2]
+        c = img.shape[2] if img.ndim == 3 else 1
+        if (h, w, c) != (header["height"], header["width"], header["channels"]):
+            raise ValueError("Kare boyutu arabellekle uyuşmuyor")
+        header["flags"] |= FLAG_WRITING
+        header["result_len"] = 0
+        _write_header(mm, header)
+        mm[HEADER_SIZE:HEADER_SIZE + img.nbytes] = np.ascontiguousarray(img, dtype=np.uint8).tobytes()
+        # 0 "kare yok" anlamına gelir, sarmada atlanır
+        header["seq"] = (header["seq"] % 0xFFFFFFFF) + 1
+        header["flags"] &= ~FLAG_WRITING
+        _write_header(mm, header)
+    finally:
+        mm.close()
+
+
+def write_result(source, result, seq):
+    """Sonuç sözlüğünü JSON olarak arabelleğin sonuç bölgesine yaz
+
+    seq, işlenen karenin işlem başındaki sıra numarasıdır. Kare bu sırada
+    değiştiyse (yeni kare yazıldı ya da yazılıyor) sonuç geçersizdir ve
+    yerine hata yazılır. Yazılan sonuç döner.
+    """
+    mm = _map(shm_path(source))
+    try:
+        header = _read_header(mm)
+        if header["seq"] != seq or header["flags"] & FLAG_WRITING:
+            result = {"success": False, "error": "Kare işlem sırasında değişti"}
+        data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        if len(data) > header["result_capacity"]:
+            raise ValueError("Sonuç arabelleğe sığmıyor")
+        offset = HEADER_SIZE + header["width"] * header["height"] * header["channels"]
+        mm[offset:offset + len(data)] = data
+        header["result_len"] = len(data)
+        header["result_seq"] = seq
+        _write_header(mm, header)
+        mm.flush()
+    finally:
+        mm.close()
+    return result
+
+
+def read_result(source):
+    """Arabellekteki karenin sonucunu oku (yoksa ya da eski kareye aitse None)"""
+    mm = _map(shm_path(source))
+    try:
+        header = _read_header(mm)
+        if header["result_len"] == 0 or header["result_seq"] != header["seq"]:
+            return None
+        offset = HEADER_SIZE + header["width"] * header["height"] * header["channels"]
+        return json.loads(mm[offset:offset + header["result_len"]].decode("utf-8"))
+    finally:
+        mm.close()
+
+
+def load_image(source):
+    """Görseli yükle: 'shm:' kaynakları kopyasız, diğerleri cv2.imread ile"""
+    if is_shared(source):
+        try:
+            return open_shared_frame(source)
+        except (OSError, ValueError):
+            return None
+    return cv2.imread(source)
+
+
+def output_path_for(source, suffix):
+    """Çıktı yolunu üret: yalnızca dosya adının uzantısından önce sonek ekle"""
+    root, ext = os.path.splitext(source)
+    return f"{root}{suffix}{ext or '.jpg'}"
+
+
+def face_to_dict(face):
+    """YuNet satırını (x, y, w, h, 5 nokta, skor) JSON'a uygun sözlüğe çevir"""
+    x, y, w, h = (int(v) for v in face[:4])
+    landmarks = [[float(face[i]), float(face[i + 1])] for i in range(4, 14, 2)]
+    return {"box": [x, y, w, h], "landmarks": landmarks, "score": float(face[-1])}
+
+
+def parse_render_args(argv):
+    """Komut satırından çizim seçeneklerini ayır
+
+    --results-only : görsel çizilmez/kaydedilmez, yalnızca JSON döner
+    --preview=N    : çıktı görseli uzun kenarı N piksel olacak şekilde küçültülür
+
+    N pozitif bir tam sayı değilse ValueError fırlatılır.
+    """
+    args = []
+    render = True
+    preview_max = None
+    for arg in argv:
+        if arg == "--results-only":
+            render = False
+        elif arg.startswith("--preview="):
+            value = arg.split("=", 1)[1]
+            try:
+                preview_max = int(value)
+            except ValueError:
+                preview_max = 0
+            if preview_max < 1:
+                raise ValueError(f"--preview pozitif bir tam sayı olmalı: {value}")
+        else:
+            args.append(arg)
+    return args, render, preview_max
+
+
+def render_annotations(img, annotations, source, suffix, preview_max=None):
+    """Kutuları çiz ve kaydet; yalnızca çıktı istendiğinde çağrılır
+
+    annotations: [{"box": [x, y, w, h], "label": str, "color": (b, g, r)}]
+    Paylaşılan karede tam çözünürlükte yerinde çizilir; dosyalarda
+    preview_max verilirse önce küçültülüp sonra çizilir.
+    """
+    scale = 1.0
+    if not is_shared(source) and preview_max:
+        h, w = img.shape[:2]
+        scale = min(1.0, preview_max / float(max(h, w)))
+        if scale < 1.0:
+            img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))),
+                             interpolation=cv2.INTER_AREA)
+    thickness = max(1, int(round(3 * scale)))
+    font_scale = 0.9 * max(scale, 0.4)
+    for ann in annotations:
+        x, y, w, h = (int(round(v * scale)) for v in ann["box"])
+        cv2.rectangle(img, (x, y), (x + w, y + h), ann["color"], thickness)
+        if ann.get("label"):
+            cv2.putText(img, ann["label"], (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX,
+                        font_scale, ann["color"], max(1, thickness - 1))
+    if is_shared(source):
+        return source
+    output_path = output_path_for(source, suffix)
+    cv2.imwrite(output_path, img)
+    return output_path